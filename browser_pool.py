@@ -0,0 +1,123 @@
+import queue
+import threading
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+from lighthouse import HEADLESS_FLAG, _find_browser
+
+# Flags for the pooled browsers, on top of HEADLESS_FLAG for headless pools
+POOL_BROWSER_FLAGS = ["--disable-gpu", "--no-sandbox", "--disable-dev-shm-usage"]
+
+class BrowserPool:
+    """A pool of WebDriver-controlled browsers reused across Lighthouse audits
+
+    Drivers are started on demand, up to size of them, and kept alive until
+    close(), so only the first audits pay for a browser cold start. Pass the
+    pool to Lighthouse (or WebsitePerformanceAnalyzer) to audit in its browsers.
+    """
+
+    def __init__(self, size=1, use_brave=True, headless=True):
+        self.size = size
+        self.use_brave = use_brave
+        self.headless = headless
+        self._drivers = []
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._broken = False
+
+    def _create_driver(self):
+        """Start a new browser under WebDriver control"""
+        options = webdriver.ChromeOptions()
+        if self.headless:
+            options.add_argument(HEADLESS_FLAG)
+        for flag in POOL_BROWSER_FLAGS:
+            options.add_argument(flag)
+
+        # Brave and Chrome share chromedriver; point it at the preferred binary
+        browser_type, browser_path = _find_browser(self.use_brave)
+        if browser_path:
+            options.binary_location = browser_path
+
+        return webdriver.Chrome(options=options)
+
+    def acquire(self):
+        """Check out a browser, waiting for one if all are busy
+
+        Returns None if no browser can be started, so callers can fall back
+        to launching their own.
+        """
+        while True:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+
+            with self._lock:
+                if self._broken:
+                    return None
+                if len(self._drivers) < self.size:
+                    # Reserve the slot before the (slow) launch
+                    self._drivers.append(None)
+                    break
+
+            # All browsers are busy; wait for one, rechecking now and then in
+            # case a slot frees up because a dead browser was discarded
+            try:
+                return self._idle.get(timeout=1)
+            except queue.Empty:
+                pass
+
+        try:
+            driver = self._create_driver()
+        except WebDriverException as e:
+            print(f"Error starting pooled browser: {e}")
+            with self._lock:
+                self._drivers.remove(None)
+                # Don't retry on every audit if the browser can't start at all
+                self._broken = not self._drivers
+            return None
+        except BaseException:
+            # Free the reserved slot, or later acquires wait for it forever
+            with self._lock:
+                self._drivers.remove(None)
+            raise
+
+        with self._lock:
+            self._drivers[self._drivers.index(None)] = driver
+        return driver
+
+    def release(self, driver):
+        """Return a browser to the pool, clearing its cache and cookies first"""
+        try:
+            driver.execute_cdp_cmd('Network.clearBrowserCache', {})
+            driver.execute_cdp_cmd('Network.clearBrowserCookies', {})
+        except WebDriverException as e:
+            # The browser died mid-audit; drop it so a fresh one is started
+            print(f"Discarding pooled browser: {e}")
+            with self._lock:
+                self._drivers.remove(driver)
+            self._quit(driver)
+            return
+
+        self._idle.put(driver)
+
+    def _quit(self, driver):
+        try:
+            driver.quit()
+        except WebDriverException:
+            pass
+
+    def close(self):
+        """Quit every browser in the pool"""
+        with self._lock:
+            drivers = [driver for driver in self._drivers if driver is not None]
+            self._drivers = []
+            self._idle = queue.Queue()
+
+        for driver in drivers:
+            self._quit(driver)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -1,37 +1,173 @@
-import requests
 from bs4 import BeautifulSoup
+import functools
+import itertools
+import os
 import re
+import sys
 import cssselect
+import tinycss2
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from urllib.parse import urljoin
+from utils import HTML_PARSER, REQUEST_TIMEOUT, create_session
+
+# Upper bound on concurrent stylesheet downloads per extraction
+MAX_CSS_FETCH_WORKERS = 16
+
+# Pseudo-classes/elements such as ':hover', '::before' or ':not(.x)'
+_PSEUDO_RE = re.compile(r'::?[A-Za-z-]+(?:\([^)]*\))?')
+
+# Tag, class and id atoms of a selector, e.g. 'nav', '.logo' and '#main'
+_ATOM_RE = re.compile(r'[#.]?[A-Za-z_][A-Za-z0-9_-]*')
+
+# Class-name markers for hero/banner and section elements, matched anywhere in
+# an element's class attribute regardless of case
+_HERO_RE = re.compile(r'hero|banner', re.IGNORECASE)
+_SECTION_RE = re.compile(r'section', re.IGNORECASE)
+
+# Below this much CSS in total, starting worker processes costs more than
+# parsing the stylesheets serially
+PROCESS_POOL_MIN_CSS_BYTES = 512 * 1024
+
+# Header and common essential CSS properties that should always be included
+_CRITICAL_CSS_PREAMBLE = """/* Critical CSS extracted by PageSpeed AI */
+
+html, body {
+    margin: 0;
+    padding: 0;
+    box-sizing: border-box;
+}
+
+*, *::before, *::after {
+    box-sizing: inherit;
+}
+"""
+
+# Number of distinct stylesheets whose parse results are kept per process
+CSS_PARSE_CACHE_SIZE = 256
+
+
+# The parse caches are keyed by the stylesheet text itself: str caches its
+# hash, so a lookup costs one hash of the text per string object and a
+# memcmp on a hit, which is cheaper than digesting the text on every call.
+def _usable_cpu_count():
+    """Count the CPUs this process may run on.
+
+    os.cpu_count() counts every CPU in the machine, ignoring the affinity mask
+    (e.g. taskset, container CPU sets), so prefer sched_getaffinity where the
+    platform has it.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+@functools.lru_cache(maxsize=CSS_PARSE_CACHE_SIZE)
+def _parse_rules(css_content):
+    """Parse CSS content into a tuple of (selector, declarations) rules.
+
+    Only top-level style rules are returned; @media, @keyframes, etc. are
+    skipped as a whole, including the rules nested inside them.
+    """
+    rules = []
+    for node in tinycss2.parse_stylesheet(css_content, skip_comments=True, skip_whitespace=True):
+        if node.type != 'qualified-rule':
+            continue
+
+        declarations = []
+        for declaration in tinycss2.parse_declaration_list(node.content, skip_comments=True, skip_whitespace=True):
+            if declaration.type != 'declaration':
+                continue
+            value = tinycss2.serialize(declaration.value).strip()
+            if declaration.important:
+                value += ' !important'
+            declarations.append(f"{declaration.name}: {value}")
+
+        rules.append((tinycss2.serialize(node.prelude).strip(), tuple(declarations)))
+
+    return tuple(rules)
+
+
+@functools.lru_cache(maxsize=CSS_PARSE_CACHE_SIZE)
+def _parse_selectors(css_content):
+    """Parse CSS content into a tuple of (selector, base selector) pairs.
+
+    The base selector has pseudo-classes/elements removed for matching purposes.
+    """
+    selectors = []
+    for selector, _ in _parse_rules(css_content):
+        # Split combined selectors
+        for s in selector.split(','):
+            s = sys.intern(s.strip())
+            selectors.append((s, _PSEUDO_RE.sub('', s)))
+
+    return tuple(selectors)
+
+
+def _element_atoms(element_selectors):
+    """Reduce element selectors to the set of tag/class/id atoms they contain."""
+    # Compound element selectors ('div.hero', 'header nav') can never be
+    # index keys, so they are matched through their atoms
+    return frozenset(sys.intern(atom) for element_selector in element_selectors
+                     for atom in _ATOM_RE.findall(element_selector))
+
+
+def _match_selectors(element_atoms, css_selectors):
+    """Return the CSS selectors that contain any of the given atoms."""
+    # Index each CSS selector under the tag/class/id atoms it contains,
+    # so matching is one lookup per atom instead of a substring scan of
+    # every CSS selector
+    index = defaultdict(set)
+    for css_selector, base_selector in css_selectors:
+        for atom in _ATOM_RE.findall(base_selector):
+            index[sys.intern(atom)].add(css_selector)
+
+    # Look up only the atoms present on both sides. Most CSS selectors share
+    # no atom with the above-fold elements and are never touched.
+    return set().union(*(index[atom] for atom in index.keys() & element_atoms))
+
+
+def _process_stylesheet(content, element_atoms):
+    """Parse one stylesheet and match it, returning (rules, matching selectors).
+
+    Runs in a worker process, so it takes and returns only picklable values;
+    the rules are sent back so the parent doesn't have to parse them again.
+    """
+    return _parse_rules(content), _match_selectors(element_atoms, _parse_selectors(content))
+
 
 class CriticalCSSExtractor:
-    def __init__(self, url, viewport_width=1200, viewport_height=800):
+    def __init__(self, url, viewport_width=1200, viewport_height=800, html=None, session=None):
         """Initialize the critical CSS extractor.
 
         Args:
             url: The URL of the webpage to analyze
             viewport_width: The viewport width to consider for above-the-fold content
             viewport_height: The viewport height to consider for above-the-fold content
+            html: The page HTML, if the caller already has it; skips re-downloading the page
+            session: A requests.Session to fetch with, e.g. one shared with other components
         """
         self.url = url
         self.viewport_width = viewport_width
         self.viewport_height = viewport_height
-        self.html = None
+        self.html = html
         self.dom = None
         self.css_files = []
         self.css_contents = {}
         self.critical_selectors = set()
+        # Rules parsed in worker processes, by CSS URL (see extract_critical_css)
+        self._parsed_rules = {}
+        # One pooled session for the page and all of its stylesheets, so requests
+        # to the same origin reuse a single keep-alive connection
+        self.session = session or create_session(pool_maxsize=MAX_CSS_FETCH_WORKERS)
 
     def fetch_page(self):
-        """Fetch the webpage HTML."""
+        """Fetch the webpage HTML, unless it was supplied by the caller."""
         try:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            }
-            response = requests.get(self.url, headers=headers)
-            response.raise_for_status()
-            self.html = response.text
-            self.dom = BeautifulSoup(self.html, 'html.parser')
+            if self.html is None:
+                response = self.session.get(self.url, timeout=REQUEST_TIMEOUT)
+                response.raise_for_status()
+                self.html = response.text
+            self.dom = BeautifulSoup(self.html, HTML_PARSER)
             return True
         except Exception as e:
             print(f"Error fetching page: {e}")
@@ -60,39 +196,41 @@ class CriticalCSSExtractor:
 
         return True
 
+    def _fetch_css_file(self, css_url):
+        """Fetch a single external CSS file, returning (url, text or None)."""
+        try:
+            response = self.session.get(css_url, timeout=REQUEST_TIMEOUT)
+            response.raise_for_status()
+            return css_url, response.text
+        except Exception as e:
+            print(f"Error fetching CSS file {css_url}: {e}")
+            return css_url, None
+
     def fetch_css_contents(self):
         """Fetch the contents of all external CSS files."""
-        for css_url in self.css_files:
-            # Skip inline styles that are already stored
-            if css_url.startswith('inline-'):
-                continue
-
-            try:
-                response = requests.get(css_url)
-                response.raise_for_status()
-                self.css_contents[css_url] = response.text
-            except Exception as e:
-                print(f"Error fetching CSS file {css_url}: {e}")
+        # Skip inline styles that are already stored
+        external_urls = [css_url for css_url in self.css_files if not css_url.startswith('inline-')]
+        if not external_urls:
+            return
+
+        # Downloads are I/O-bound, so fetch them concurrently over one shared
+        # session; map() keeps results in document order.
+        max_workers = min(MAX_CSS_FETCH_WORKERS, len(external_urls))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for css_url, content in executor.map(self._fetch_css_file, external_urls):
+                if content is not None:
+                    self.css_contents[css_url] = content
+
+    def get_css_rules(self, css_url):
+        """Return the (selector, declarations) rules of a stylesheet, parsing it only once."""
+        rules = self._parsed_rules.get(css_url)
+        if rules is None:
+            rules = _parse_rules(self.css_contents[css_url])
+        return rules
 
     def parse_css(self, css_content):
-        """Parse CSS content and extract selectors."""
-        # Regular expression to extract selectors from CSS
-        # This is simplified and doesn't handle all edge cases
-        selector_pattern = re.compile(r'([^{]+){[^}]*}')
-        matches = selector_pattern.findall(css_content)
-
-        selectors = []
-        for match in matches:
-            # Clean up selector (remove comments, whitespace)
-            selector = match.strip()
-            # Skip @media, @keyframes, etc.
-            if selector.startswith('@'):
-                continue
-            # Split combined selectors
-            for s in selector.split(','):
-                selectors.append(s.strip())
-
-        return selectors
+        """Parse CSS content and extract (selector, base selector) pairs."""
+        return list(_parse_selectors(css_content))
 
     def find_above_fold_elements(self):
         """Find elements that are above the fold."""
@@ -101,79 +239,94 @@ class CriticalCSSExtractor:
         # For this simplified version, we'll consider all elements
         # in the first part of the document as "above the fold".
 
-        # Get elements that are likely above the fold
-        above_fold_elements = []
-
-        # Header elements
-        above_fold_elements.extend(self.dom.find_all(['header', 'nav']))
+        # Get elements that are likely above the fold, collecting every
+        # category in a single walk over the tree
+        header_elements = []  # Header elements
+        hero_sections = []    # Hero sections or main banners (commonly above fold)
+        sections = []         # First few sections
+        lcp_image = None      # LCP image (largest contentful paint)
+        lcp_area = -1
+
+        # Above-fold candidates live in <body>, so skip the <head> subtree
+        # (links, meta, scripts) entirely
+        root = self.dom.body or self.dom
+        for element in root.descendants:
+            name = element.name
+            if name is None:
+                # Text, comments and other non-tag nodes
+                continue
 
-        # Hero sections or main banners (commonly above fold)
-        hero_sections = self.dom.find_all(class_=lambda c: c and ('hero' in c.lower() or 'banner' in c.lower()))
-        above_fold_elements.extend(hero_sections)
+            if name in ('header', 'nav'):
+                header_elements.append(element)
+
+            classes = element.get('class')
+            if classes:
+                class_string = ' '.join(classes)
+                if _HERO_RE.search(class_string):
+                    hero_sections.append(element)
+                # Take the first few sections (likely above fold)
+                if name in ('section', 'div') and len(sections) < 3 and _SECTION_RE.search(class_string):
+                    sections.append(element)
+
+            # Keep the largest image by its width/height attributes
+            if name == 'img':
+                try:
+                    area = int(element['width']) * int(element['height'])
+                except (KeyError, ValueError):
+                    # Missing or non-numeric size, e.g. width="100%"
+                    continue
+                if area > lcp_area:
+                    lcp_image = element
+                    lcp_area = area
 
-        # First few sections
-        sections = self.dom.find_all(['section', 'div'], class_=lambda c: c and 'section' in c.lower())
-        if sections:
-            # Take the first few sections (likely above fold)
-            above_fold_elements.extend(sections[:3])
+        above_fold_elements = header_elements + hero_sections + sections
 
-        # LCP image (largest contentful paint)
-        lcp_candidates = self.dom.find_all('img')
-        if lcp_candidates:
-            # Sort by size (if width/height attributes are present)
-            sized_images = [img for img in lcp_candidates if img.has_attr('width') and img.has_attr('height')]
-            if sized_images:
-                sized_images.sort(key=lambda img: int(img['width']) * int(img['height']), reverse=True)
-                above_fold_elements.append(sized_images[0])
+        if lcp_image is not None:
+            above_fold_elements.append(lcp_image)
 
         return above_fold_elements
 
     def extract_element_selectors(self, elements):
         """Extract CSS selectors that target the given elements."""
         selectors = set()
+        add = selectors.add
+        # Selectors are interned so identical fragments share one object and
+        # set/dict lookups against the CSS atoms hit CPython's identity shortcut
+        intern = sys.intern
 
         for element in elements:
+            # Read each attribute once instead of repeated has_attr/[] lookups
+            name = element.name
+            classes = element.get('class') or ()
+            element_id = element.get('id')
+            parent = element.parent
+            parent_name = parent.name if parent is not None else None
+
             # Add the element's tag
-            selectors.add(element.name)
+            add(intern(name))
 
             # Add classes
-            if element.has_attr('class'):
-                for cls in element['class']:
-                    selectors.add(f".{cls}")
-                    selectors.add(f"{element.name}.{cls}")
+            for cls in classes:
+                add(intern(f".{cls}"))
+                add(intern(f"{name}.{cls}"))
 
             # Add ID
-            if element.has_attr('id'):
-                selectors.add(f"#{element['id']}")
+            if element_id is not None:
+                add(intern(f"#{element_id}"))
 
             # Add parent-child relationships for better specificity
-            parent = element.parent
-            if parent and parent.name != '[document]':
-                if parent.name:
-                    selectors.add(f"{parent.name} {element.name}")
+            if parent_name and parent_name != '[document]':
+                add(intern(f"{parent_name} {name}"))
 
-                    # Add with classes
-                    if element.has_attr('class'):
-                        for cls in element['class']:
-                            selectors.add(f"{parent.name} .{cls}")
+                # Add with classes
+                for cls in classes:
+                    add(intern(f"{parent_name} .{cls}"))
 
         return selectors
 
     def match_selectors(self, element_selectors, css_selectors):
-        """Match element selectors with CSS selectors."""
-        matching_selectors = set()
-
-        for css_selector in css_selectors:
-            # Remove pseudo-classes/elements for matching purposes
-            base_selector = re.sub(r'::?[a-zA-Z-]+(\([^)]*\))?', '', css_selector)
-
-            # Check if this CSS selector matches any of our element selectors
-            for element_selector in element_selectors:
-                if element_selector in base_selector:
-                    matching_selectors.add(css_selector)
-                    break
-
-        return matching_selectors
+        """Match element selectors with the (selector, base selector) pairs from parse_css."""
+        return _match_selectors(_element_atoms(element_selectors), css_selectors)
 
     def extract_critical_css(self):
         """Extract critical CSS for above-the-fold content."""
@@ -195,14 +348,27 @@ class CriticalCSSExtractor:
 
         # Parse all CSS and find matching selectors
         all_critical_selectors = set()
-
-        for css_url, css_content in self.css_contents.items():
-            # Parse CSS content to get selectors
-            css_selectors = self.parse_css(css_content)
-
-            # Match selectors
-            matching_selectors = self.match_selectors(element_selectors, css_selectors)
-            all_critical_selectors.update(matching_selectors)
+        element_atoms = _element_atoms(element_selectors)
+        css_urls = list(self.css_contents)
+        contents = [self.css_contents[css_url] for css_url in css_urls]
+
+        # Parsing is CPU-bound pure Python, so large multi-stylesheet pages are
+        # spread across processes to get past the GIL. With a single worker
+        # that would only add process startup and pickling.
+        max_workers = min(len(contents), _usable_cpu_count())
+        if max_workers > 1 and sum(map(len, contents)) >= PROCESS_POOL_MIN_CSS_BYTES:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                results = executor.map(_process_stylesheet, contents, itertools.repeat(element_atoms))
+                for css_url, (rules, matching_selectors) in zip(css_urls, results):
+                    self._parsed_rules[css_url] = rules
+                    all_critical_selectors.update(matching_selectors)
+        else:
+            for css_content in contents:
+                # Parse CSS content to get selectors
+                css_selectors = _parse_selectors(css_content)
+
+                # Match selectors
+                all_critical_selectors.update(_match_selectors(element_atoms, css_selectors))
 
         # Extract critical CSS rules
         critical_css = self.generate_critical_css(all_critical_selectors)
@@ -211,53 +377,32 @@ class CriticalCSSExtractor:
 
     def generate_critical_css(self, critical_selectors):
         """Generate critical CSS from selected selectors."""
-        critical_css = "/* Critical CSS extracted by PageSpeed AI */\n"
-
-        # Common essential CSS properties that should always be included
-        critical_css += """
-html, body {
-    margin: 0;
-    padding: 0;
-    box-sizing: border-box;
-}
-
-*, *::before, *::after {
-    box-sizing: inherit;
-}
-"""
+        # Collect fragments and join once; repeated += on a growing string
+        # copies it every time
+        parts = [_CRITICAL_CSS_PREAMBLE]
+        append = parts.append
 
         # Add CSS for selected critical selectors
-        for css_url, css_content in self.css_contents.items():
-            # Regular expression to extract selector and rules
-            rule_pattern = re.compile(r'([^{]+){([^}]*)}')
-            matches = rule_pattern.findall(css_content)
-
-            for selector, rules in matches:
-                selector = selector.strip()
-
-                # Skip @media, @keyframes, etc.
-                if selector.startswith('@'):
-                    continue
-
+        for css_url in self.css_contents:
+            for selector, declarations in self.get_css_rules(css_url):
                 # Check if this selector is in our critical selectors
                 selector_parts = [s.strip() for s in selector.split(',')]
 
                 if any(s in critical_selectors for s in selector_parts):
-                    critical_css += f"{selector} {{\n"
+                    append(f"{selector} {{\n")
 
                     # Format rules nicely
-                    rule_parts = [r.strip() for r in rules.split(';') if r.strip()]
-                    for rule in rule_parts:
-                        critical_css += f"    {rule};\n"
+                    for rule in declarations:
+                        append(f"    {rule};\n")
 
-                    critical_css += "}\n\n"
+                    append("}\n\n")
 
-        return critical_css
+        return "".join(parts)
 
 
-def extract_critical_css(url, viewport_width=1200, viewport_height=800):
+def extract_critical_css(url, viewport_width=1200, viewport_height=800, html=None, session=None):
     """Helper function to extract critical CSS from a URL."""
-    extractor = CriticalCSSExtractor(url, viewport_width, viewport_height)
+    extractor = CriticalCSSExtractor(url, viewport_width, viewport_height, html=html, session=session)
     return extractor.extract_critical_css()
 
 
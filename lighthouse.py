@@ -1,115 +1,326 @@
+import atexit
+import functools
 import json
 import subprocess
 import os
 import tempfile
 import platform
 import shutil
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from utils import json_loads
 
-class Lighthouse:
-    def __init__(self, driver=None, use_brave=True):
-        self.driver = driver
-        self.use_brave = use_brave
+# The OS never changes while running, so detect it once at import
+_SYSTEM = platform.system()
 
-    def _get_browser_path(self):
-        """Get the path to browser based on preference and OS"""
-        system = platform.system()
-
-        # Try to find Brave if preferred
-        if self.use_brave:
-            if system == "Darwin":  # macOS
-                brave_path = "/Applications/Brave Browser.app/Contents/MacOS/Brave Browser"
-                if os.path.exists(brave_path):
-                    return "brave", brave_path
-            elif system == "Linux":
-                brave_path = "/usr/bin/brave-browser"
-                if os.path.exists(brave_path):
-                    return "brave", brave_path
-            elif system == "Windows":
-                # Common Windows installation paths
-                program_files = os.environ.get("PROGRAMFILES", "C:\\Program Files")
-                program_files_x86 = os.environ.get("PROGRAMFILES(X86)", "C:\\Program Files (x86)")
-
-                paths = [
-                    os.path.join(program_files, "BraveSoftware", "Brave-Browser", "Application", "brave.exe"),
-                    os.path.join(program_files_x86, "BraveSoftware", "Brave-Browser", "Application", "brave.exe")
-                ]
-
-                for path in paths:
-                    if os.path.exists(path):
-                        return "brave", path
-
-        # Fall back to Chrome if Brave not found or not preferred
-        if system == "Darwin":  # macOS
-            chrome_path = "/Applications/Google Chrome.app/Contents/MacOS/Google Chrome"
-            if os.path.exists(chrome_path):
-                return "chrome", chrome_path
-        elif system == "Linux":
-            chrome_paths = ["/usr/bin/google-chrome", "/usr/bin/chromium-browser", "/usr/bin/chromium"]
-            for path in chrome_paths:
-                if os.path.exists(path):
-                    return "chrome", path
-        elif system == "Windows":
+@functools.lru_cache(maxsize=None)
+def _find_browser(use_brave):
+    """Find the preferred browser installed on this machine
+
+    The browser location doesn't change during a run, so the lookup (a dozen
+    os.path.exists calls) is done once per preference and cached.
+    """
+    # Try to find Brave if preferred
+    if use_brave:
+        if _SYSTEM == "Darwin":  # macOS
+            brave_path = "/Applications/Brave Browser.app/Contents/MacOS/Brave Browser"
+            if os.path.exists(brave_path):
+                return "brave", brave_path
+        elif _SYSTEM == "Linux":
+            brave_path = "/usr/bin/brave-browser"
+            if os.path.exists(brave_path):
+                return "brave", brave_path
+        elif _SYSTEM == "Windows":
             # Common Windows installation paths
             program_files = os.environ.get("PROGRAMFILES", "C:\\Program Files")
             program_files_x86 = os.environ.get("PROGRAMFILES(X86)", "C:\\Program Files (x86)")
 
             paths = [
-                os.path.join(program_files, "Google", "Chrome", "Application", "chrome.exe"),
-                os.path.join(program_files_x86, "Google", "Chrome", "Application", "chrome.exe")
+                os.path.join(program_files, "BraveSoftware", "Brave-Browser", "Application", "brave.exe"),
+                os.path.join(program_files_x86, "BraveSoftware", "Brave-Browser", "Application", "brave.exe")
             ]
 
             for path in paths:
                 if os.path.exists(path):
-                    return "chrome", path
+                    return "brave", path
+
+    # Fall back to Chrome if Brave not found or not preferred
+    if _SYSTEM == "Darwin":  # macOS
+        chrome_path = "/Applications/Google Chrome.app/Contents/MacOS/Google Chrome"
+        if os.path.exists(chrome_path):
+            return "chrome", chrome_path
+    elif _SYSTEM == "Linux":
+        chrome_paths = ["/usr/bin/google-chrome", "/usr/bin/chromium-browser", "/usr/bin/chromium"]
+        for path in chrome_paths:
+            if os.path.exists(path):
+                return "chrome", path
+    elif _SYSTEM == "Windows":
+        # Common Windows installation paths
+        program_files = os.environ.get("PROGRAMFILES", "C:\\Program Files")
+        program_files_x86 = os.environ.get("PROGRAMFILES(X86)", "C:\\Program Files (x86)")
+
+        paths = [
+            os.path.join(program_files, "Google", "Chrome", "Application", "chrome.exe"),
+            os.path.join(program_files_x86, "Google", "Chrome", "Application", "chrome.exe")
+        ]
+
+        for path in paths:
+            if os.path.exists(path):
+                return "chrome", path
+
+    return None, None  # No browser found
+
+# Flags for the browsers audits run in; headless unless a headed run is asked for
+HEADLESS_FLAG = "--headless=new"
+BROWSER_FLAGS = ["--no-sandbox", "--disable-gpu"]
+
+# Seconds to wait for a launched browser to report its remote debugging port
+BROWSER_STARTUP_TIMEOUT = 15
+
+class _Browser:
+    """A browser process kept alive between Lighthouse audits"""
+
+    def __init__(self, process, port, user_data_dir):
+        self.process = process
+        self.port = port
+        self.user_data_dir = user_data_dir
+
+    @classmethod
+    def launch(cls, browser_path, flags):
+        """Launch a browser with the given flags, returning None if it doesn't come up"""
+        user_data_dir = tempfile.mkdtemp(prefix="pagespeed-ai-browser-")
+        cmd = [browser_path] + flags + [
+            "--remote-debugging-port=0",
+            f"--user-data-dir={user_data_dir}",
+            "--no-first-run",
+            "--no-default-browser-check",
+            "about:blank"
+        ]
+
+        try:
+            process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except OSError as e:
+            print(f"Error launching browser: {e}")
+            shutil.rmtree(user_data_dir, ignore_errors=True)
+            return None
+
+        # With port 0 the browser picks a free port and writes it to the first
+        # line of DevToolsActivePort once it is listening
+        port_file = os.path.join(user_data_dir, "DevToolsActivePort")
+        deadline = time.monotonic() + BROWSER_STARTUP_TIMEOUT
+        while time.monotonic() < deadline and process.poll() is None:
+            try:
+                with open(port_file, 'r') as f:
+                    return cls(process, int(f.readline()), user_data_dir)
+            except (OSError, ValueError):
+                time.sleep(0.1)
+
+        print("Browser did not start in time")
+        browser = cls(process, None, user_data_dir)
+        browser.close()
+        return None
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def close(self):
+        """Terminate the browser and remove its temporary profile"""
+        if self.is_alive():
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        shutil.rmtree(self.user_data_dir, ignore_errors=True)
+
+class _DriverBrowser:
+    """A browser controlled by a Selenium WebDriver that Lighthouse attaches to"""
+
+    def __init__(self, driver):
+        self.driver = driver
+        # chromedriver reports the browser's DevTools endpoint as "host:port"
+        address = driver.capabilities["goog:chromeOptions"]["debuggerAddress"]
+        self.port = int(address.rsplit(":", 1)[1])
+
+class Lighthouse:
+    def __init__(self, driver=None, use_brave=True, browser_pool=None, headless=True):
+        self.driver = driver
+        self.use_brave = use_brave
+        self.headless = headless
+        # Optional BrowserPool whose browsers audits run in
+        self.browser_pool = browser_pool
+        # A single caller-supplied driver can only run one audit at a time
+        self._driver_lock = threading.Lock()
+
+        # Browsers are launched on demand and reused by later audits. Lighthouse
+        # can't share one browser between concurrent runs, so each concurrent
+        # audit checks out its own.
+        self._browsers = []
+        self._idle_browsers = []
+        self._browser_lock = threading.Lock()
 
-        return None, None  # No browser found
+        # Audits currently running, by URL, so concurrent callers asking for
+        # the same URL share one Lighthouse run
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+
+    def _get_browser_path(self):
+        """Get the path to browser based on preference and OS"""
+        return _find_browser(self.use_brave)
+
+    def _browser_flags(self):
+        """Get the flags for browsers launched for audits"""
+        if self.headless:
+            return [HEADLESS_FLAG] + BROWSER_FLAGS
+        return BROWSER_FLAGS
+
+    def _acquire_browser(self, browser_path):
+        """Check out an idle kept-alive browser, launching one if none is free"""
+        # Prefer browsers the caller already runs under WebDriver
+        if self.driver is not None:
+            self._driver_lock.acquire()
+            browser = self._attach_driver(self.driver)
+            if browser:
+                return browser
+            self._driver_lock.release()
+
+        if self.browser_pool is not None:
+            driver = self.browser_pool.acquire()
+            if driver is not None:
+                browser = self._attach_driver(driver)
+                if browser:
+                    return browser
+                self.browser_pool.release(driver)
+
+        with self._browser_lock:
+            while self._idle_browsers:
+                browser = self._idle_browsers.pop()
+                if browser.is_alive():
+                    return browser
+                self._browsers.remove(browser)
+                browser.close()
+
+        browser = _Browser.launch(browser_path, self._browser_flags())
+        if browser:
+            with self._browser_lock:
+                if not self._browsers:
+                    atexit.register(self.close)
+                self._browsers.append(browser)
+        return browser
+
+    def _attach_driver(self, driver):
+        """Wrap a WebDriver's browser for Lighthouse, or None if it exposes no DevTools port"""
+        try:
+            return _DriverBrowser(driver)
+        except Exception as e:
+            # Non-Chrome and remote drivers don't report a local debuggerAddress
+            print(f"Can't attach Lighthouse to WebDriver browser: {e!r}")
+            return None
+
+    def _release_browser(self, browser):
+        """Return a browser to the idle list for the next audit"""
+        if isinstance(browser, _DriverBrowser):
+            if browser.driver is self.driver:
+                self._driver_lock.release()
+            else:
+                self.browser_pool.release(browser.driver)
+            return
+
+        with self._browser_lock:
+            if browser in self._browsers:
+                self._idle_browsers.append(browser)
+
+    def close(self):
+        """Shut down the browsers kept alive between audits"""
+        with self._browser_lock:
+            browsers = self._browsers
+            self._browsers = []
+            self._idle_browsers = []
+
+        for browser in browsers:
+            browser.close()
+        atexit.unregister(self.close)
 
     def audit(self, url):
         """Run Lighthouse analysis"""
-        print("Running Lighthouse audit...")
+        with self._inflight_lock:
+            future = self._inflight.get(url)
+            is_owner = future is None
+            if is_owner:
+                future = self._inflight[url] = Future()
 
-        # Create a temporary file for the output
-        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as tmp:
-            output_path = tmp.name
+        # Another thread is already auditing this URL; wait for its result
+        if not is_owner:
+            return future.result()
+
+        try:
+            result = self._run_audit(url)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[url]
+
+    def _run_audit(self, url):
+        """Run a single Lighthouse audit, falling back to mock data on failure"""
+        print("Running Lighthouse audit...")
 
         try:
             # Get browser information
             browser_type, browser_path = self._get_browser_path()
 
-            if browser_path and os.path.exists(browser_path):
+            if browser_path:
                 print(f"Using {browser_type.capitalize()} browser at: {browser_path}")
 
-                # Build the Lighthouse command
+                # Connect to a kept-alive browser instead of paying for a cold
+                # start on every audit; if none can be launched, let Lighthouse
+                # start its own as before
+                browser = self._acquire_browser(browser_path)
+                if browser:
+                    browser_flags = [f"--port={browser.port}"]
+                else:
+                    browser_flags = [
+                        "--chrome-flags=" + " ".join(self._browser_flags()),
+                        f"--chrome-path={browser_path}"
+                    ]
+
+                # Build the Lighthouse command. The report is written to stdout
+                # (progress logs go to stderr), so no temporary file is needed.
                 cmd = [
                     "lighthouse",
                     url,
                     "--output=json",
-                    "--output-path=" + output_path,
-                    "--chrome-flags=--headless --no-sandbox --disable-gpu",
-                    "--only-categories=performance",
-                    f"--chrome-path={browser_path}"
-                ]
+                    "--output-path=stdout",
+                    "--only-categories=performance"
+                ] + browser_flags
 
                 print(f"Executing command: {' '.join(cmd)}")
 
                 # Run Lighthouse with the specified browser
-                result = subprocess.run(cmd, capture_output=True, text=True)
+                try:
+                    result = subprocess.run(cmd, capture_output=True)
+                finally:
+                    if browser:
+                        self._release_browser(browser)
 
                 if result.returncode != 0:
                     print("Lighthouse Error:")
-                    print(result.stderr)
+                    print(result.stderr.decode(errors="replace"))
                     return self._mock_lighthouse_response()
 
-                # Check if output file exists and has content
-                if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
+                # Check if Lighthouse produced a report
+                if result.stdout.strip():
                     try:
-                        with open(output_path, 'r') as f:
-                            return json.load(f)
+                        return json_loads(result.stdout)
                     except json.JSONDecodeError:
                         print("Error parsing Lighthouse results")
                         return self._mock_lighthouse_response()
                 else:
-                    print("No output file generated")
+                    print("No output generated")
                     return self._mock_lighthouse_response()
             else:
                 print(f"No compatible browser found. Using mock data.")
@@ -118,10 +329,24 @@ class Lighthouse:
         except Exception as e:
             print(f"Error running Lighthouse: {e}")
             return self._mock_lighthouse_response()
-        finally:
-            # Clean up the temporary file
-            if os.path.exists(output_path):
-                os.remove(output_path)
+
+    def audit_many(self, urls, concurrency=4):
+        """Run Lighthouse audits for several URLs in parallel
+
+        Each audit runs in its own Lighthouse/Chrome process, so concurrency caps
+        how many browsers run at once; keep it at or below the number of cores.
+
+        Returns a dict mapping each URL to its Lighthouse results.
+        """
+        unique_urls = list(dict.fromkeys(urls))
+        if not unique_urls:
+            return {}
+
+        # The worker threads only wait on subprocesses, so the pool size is
+        # effectively a semaphore on concurrent Chrome instances
+        max_workers = max(1, min(concurrency, len(unique_urls)))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return dict(zip(unique_urls, executor.map(self.audit, unique_urls)))
 
     def _mock_lighthouse_response(self):
         """Provide a mock Lighthouse response for testing"""
@@ -1,74 +1,257 @@
 from selenium import webdriver
 from lighthouse import Lighthouse
-import requests
-from bs4 import BeautifulSoup
-import json
+from browser_pool import BrowserPool
+from bs4 import BeautifulSoup, SoupStrainer
 import os
 from PIL import Image
 import io
 import sys
 import argparse
+import hashlib
 from critical_css_extractor import extract_critical_css
 from site_optimizer import optimize_and_test
 from urllib.parse import urlparse
 
+# lxml's streaming parser handles very large pages without building a tree
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+from utils import HTML_PARSER, REQUEST_TIMEOUT, create_session, ensure_dir, json_dumps, write_atomic
+
+# Upper bound on concurrent image downloads/re-encodes in optimize_images
+MAX_IMAGE_WORKERS = 32
+
+# Fraction of the original size a WebP encode must save to be worth using
+MIN_WEBP_SAVINGS = 0.10
+
+# Images smaller than this many bytes aren't worth downloading to re-encode
+MIN_IMAGE_BYTES = 4096
+
+# The only tags extract_resources looks at; everything else is skipped while
+# parsing instead of being built into the tree
+RESOURCE_TAGS = SoupStrainer(['script', 'link', 'img'])
+
+# Loading-related attributes recorded for each kind of resource
+SCRIPT_ATTRIBUTES = ('async', 'defer', 'type', 'crossorigin', 'integrity')
+STYLESHEET_ATTRIBUTES = ('rel', 'media', 'crossorigin', 'integrity')
+IMAGE_ATTRIBUTES = ('loading', 'decoding', 'srcset', 'sizes', 'width', 'height')
+
+# Pages at least this large are scanned for resources with a streaming parser
+STREAMING_PARSE_MIN_BYTES = 512 * 1024
+
+def _pick_attributes(tag, names):
+    """Copy just the named attributes of a tag into a new dict"""
+    attrs = tag.attrs
+    return {name: attrs[name] for name in names if name in attrs}
+
+def _pick_streamed_attributes(attrs, names):
+    """Like _pick_attributes, for the attributes of an lxml element"""
+    picked = {name: attrs[name] for name in names if name in attrs}
+    # Match BeautifulSoup's values: rel is split into a list, and valueless
+    # boolean attributes such as defer are empty rather than their own name
+    for name, value in picked.items():
+        if name == 'rel':
+            picked[name] = value.split()
+        elif value == name:
+            picked[name] = ''
+    return picked
+
 class WebsitePerformanceAnalyzer:
-    def __init__(self, url, use_brave=True):
+    def __init__(self, url, use_brave=True, browser_pool=None, headless=True, session=None):
         self.url = url
         self.use_brave = use_brave
+        self.headless = headless
+        # Optional BrowserPool to run audits in instead of fresh browsers
+        self.browser_pool = browser_pool
         self.lighthouse_results = None
         self.dom_elements = None
         self.resources = []
         self.critical_issues = []
-
-    def run_lighthouse_analysis(self):
-        """Run Lighthouse analysis and store results"""
+        # Keep-alive session for all page requests made by the analyzer,
+        # optionally shared with other components
+        self.session = session or create_session()
+        # Downloaded page bytes by URL, so every parse of a page shares one fetch
+        self._response_cache = {}
+
+    def run_lighthouse_analysis(self, urls=None, concurrency=4):
+        """Run Lighthouse analysis and store results
+
+        If urls is given, they are audited concurrently (at most concurrency
+        browsers at once) and a dict mapping each URL to its results is
+        returned; this analyzer keeps the results for its own URL when it is
+        among them.
+        """
         # Initialize Lighthouse
-        lighthouse = Lighthouse(use_brave=self.use_brave)
-        self.lighthouse_results = lighthouse.audit(self.url)
-
-        return self.lighthouse_results
+        lighthouse = Lighthouse(use_brave=self.use_brave, browser_pool=self.browser_pool,
+                                headless=self.headless)
 
-    def extract_dom_structure(self):
-        """Extract DOM structure for analysis"""
-        response = requests.get(self.url)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        self.dom_elements = soup
+        try:
+            if urls is None:
+                self.lighthouse_results = lighthouse.audit(self.url)
+                return self.lighthouse_results
+
+            results = lighthouse.audit_many(urls, concurrency=concurrency)
+        finally:
+            # Don't leave the kept-alive browsers running until interpreter exit
+            lighthouse.close()
+
+        if self.url in results:
+            self.lighthouse_results = results[self.url]
+        return results
+
+    @classmethod
+    def analyze_many(cls, urls, use_brave=True, concurrency=4, browser_pool=None, headless=True,
+                     session=None):
+        """Prepare analyzers for several URLs, auditing them concurrently
+
+        Lighthouse audits share one Lighthouse instance and at most concurrency
+        browsers run at once, taken from browser_pool if one is given; the
+        page fetches run in parallel as well, over session if one is given.
+
+        Returns a dict mapping each URL to its analyzer, with Lighthouse results
+        and resources already loaded so analyze_performance() does no more I/O.
+        URLs whose page can't be fetched are reported and left out.
+        """
+        analyzers = {url: cls(url, use_brave=use_brave, browser_pool=browser_pool, headless=headless,
+                              session=session)
+                     for url in urls}
+        if not analyzers:
+            return {}
+
+        lighthouse = Lighthouse(use_brave=use_brave, browser_pool=browser_pool, headless=headless)
+        try:
+            results = lighthouse.audit_many(list(analyzers), concurrency=concurrency)
+        finally:
+            lighthouse.close()
+
+        for url, analyzer in analyzers.items():
+            analyzer.lighthouse_results = results[url]
+
+        max_workers = max(1, min(concurrency, len(analyzers)))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {url: executor.submit(analyzer.extract_resources)
+                       for url, analyzer in analyzers.items()}
+
+        # One unreachable page shouldn't cost the rest of the batch its reports
+        for url, future in futures.items():
+            error = future.exception()
+            if error is not None:
+                print(f"Error analyzing {url}: {error}")
+                del analyzers[url]
+
+        return analyzers
+
+    def _fetch_content(self, url):
+        """Download a page once, returning its raw bytes"""
+        content = self._response_cache.get(url)
+        if content is None:
+            response = self.session.get(url, timeout=REQUEST_TIMEOUT)
+            content = self._response_cache[url] = response.content
+        return content
+
+    def extract_dom_structure(self, parser=HTML_PARSER, strainer=None):
+        """Extract DOM structure for analysis
+
+        With a SoupStrainer only the matching tags are parsed; that partial
+        tree is returned without replacing the cached full one.
+        """
+        # Reuse the full tree if it was already built
+        if strainer is None and self.dom_elements is not None:
+            return self.dom_elements
+
+        # Pass the raw bytes so the parser detects the encoding itself instead
+        # of requests decoding the body first
+        soup = BeautifulSoup(self._fetch_content(self.url), parser, parse_only=strainer)
+        if strainer is None:
+            self.dom_elements = soup
         return soup
 
     def extract_resources(self):
         """Extract and analyze resource loading"""
         # This would extract JS, CSS, images, fonts, etc.
-        if not self.dom_elements:
-            self.extract_dom_structure()
+        if self.dom_elements is not None:
+            soup = self.dom_elements
+        else:
+            content = self._fetch_content(self.url)
+            if etree is not None and len(content) >= STREAMING_PARSE_MIN_BYTES:
+                return self._extract_resources_streaming(content)
+
+            # Nobody needs the full tree yet, so parse only the resource tags
+            soup = self.extract_dom_structure(strainer=RESOURCE_TAGS)
 
         # Extract scripts
-        scripts = self.dom_elements.find_all('script', src=True)
-        for script in scripts:
-            self.resources.append({
-                'type': 'script',
-                'url': script['src'],
-                'attributes': script.attrs
-            })
+        scripts = [{
+            'type': 'script',
+            'url': script['src'],
+            'attributes': _pick_attributes(script, SCRIPT_ATTRIBUTES)
+        } for script in soup.find_all('script', src=True)]
 
         # Extract stylesheets
-        styles = self.dom_elements.find_all('link', rel='stylesheet')
-        for style in styles:
-            self.resources.append({
-                'type': 'stylesheet',
-                'url': style['href'],
-                'attributes': style.attrs
-            })
+        styles = [{
+            'type': 'stylesheet',
+            'url': style['href'],
+            'attributes': _pick_attributes(style, STYLESHEET_ATTRIBUTES)
+        } for style in soup.find_all('link', rel='stylesheet', href=True)]
 
         # Extract images
-        images = self.dom_elements.find_all('img', src=True)
-        for img in images:
-            self.resources.append({
-                'type': 'image',
-                'url': img['src'],
-                'attributes': img.attrs
-            })
+        images = [{
+            'type': 'image',
+            'url': img['src'],
+            'attributes': _pick_attributes(img, IMAGE_ATTRIBUTES)
+        } for img in soup.find_all('img', src=True)]
+
+        self.resources.extend(scripts)
+        self.resources.extend(styles)
+        self.resources.extend(images)
+        return self.resources
+
+    def _extract_resources_streaming(self, content):
+        """Extract resources from a large page without keeping its tree in memory
+
+        Selects exactly the tags extract_resources does: scripts and images
+        with a src, stylesheet links with an href.
+        """
+        scripts = []
+        styles = []
+        images = []
+
+        for _, element in etree.iterparse(io.BytesIO(content), events=('end',), html=True):
+            tag = element.tag
+            attrs = element.attrib
+            if tag == 'script' and 'src' in attrs:
+                scripts.append({
+                    'type': 'script',
+                    'url': attrs['src'],
+                    'attributes': _pick_streamed_attributes(attrs, SCRIPT_ATTRIBUTES)
+                })
+            elif tag == 'link' and 'stylesheet' in attrs.get('rel', '').split() and 'href' in attrs:
+                styles.append({
+                    'type': 'stylesheet',
+                    'url': attrs['href'],
+                    'attributes': _pick_streamed_attributes(attrs, STYLESHEET_ATTRIBUTES)
+                })
+            elif tag == 'img' and 'src' in attrs:
+                images.append({
+                    'type': 'image',
+                    'url': attrs['src'],
+                    'attributes': _pick_streamed_attributes(attrs, IMAGE_ATTRIBUTES)
+                })
 
+            # Free each element once it has been seen, along with the
+            # already-processed siblings before it
+            element.clear()
+            parent = element.getparent()
+            if parent is not None:
+                while element.getprevious() is not None:
+                    del parent[0]
+
+        # Same grouping as the tree-based path: scripts, stylesheets, images
+        self.resources.extend(scripts)
+        self.resources.extend(styles)
+        self.resources.extend(images)
         return self.resources
 
     def analyze_performance(self):
@@ -88,16 +271,22 @@ class WebsitePerformanceAnalyzer:
         tbt = self.lighthouse_results['audits']['total-blocking-time']['displayValue']
         cls = self.lighthouse_results['audits']['cumulative-layout-shift']['displayValue']
 
-        # Generate critical issues list
+        # Generate critical issues list, rebuilt from scratch so repeated
+        # calls don't accumulate duplicates
+        critical_issues = []
+        append = critical_issues.append
         for audit_id, audit in self.lighthouse_results['audits'].items():
-            if audit['score'] is not None and audit['score'] < 0.9 and 'details' in audit:
-                self.critical_issues.append({
+            score = audit['score']
+            if score is not None and score < 0.9 and 'details' in audit:
+                append({
                     'id': audit_id,
                     'title': audit['title'],
                     'description': audit['description'],
-                    'score': audit['score'],
-                    'details': audit.get('details', {})
+                    'score': score,
+                    'details': audit['details']
                 })
+        critical_issues.sort(key=itemgetter('score'))
+        self.critical_issues = critical_issues
 
         return {
             'performance_score': performance_score,
@@ -107,13 +296,85 @@ class WebsitePerformanceAnalyzer:
                 'total_blocking_time': tbt,
                 'cumulative_layout_shift': cls
             },
-            'critical_issues': sorted(self.critical_issues, key=lambda x: x['score'])
+            'critical_issues': critical_issues
         }
 
+# Recommendation handlers: each adds the steps and code changes for one kind
+# of Lighthouse issue to a recommendation
+def _recommend_render_blocking(recommendation, issue):
+    recommendation['steps'].append('Add defer attribute to non-critical JavaScript')
+    recommendation['steps'].append('Inline critical CSS and defer non-critical CSS')
+    recommendation['code_changes'].append({
+        'file_type': 'html',
+        'description': 'Add defer to script tags',
+        'example': '<script src="non-critical.js" defer></script>'
+    })
+
+def _recommend_minification(recommendation, issue):
+    recommendation['steps'].append(f"Minify {issue['id'].split('-')[1].upper()} files")
+    recommendation['steps'].append('Set up build process with minification tools')
+
+def _recommend_unused_css(recommendation, issue):
+    recommendation['steps'].append('Remove unused CSS')
+    recommendation['steps'].append('Consider using PurgeCSS to automatically remove unused styles')
+
+def _recommend_unused_javascript(recommendation, issue):
+    recommendation['steps'].append('Implement code splitting')
+    recommendation['steps'].append('Remove dead code')
+
+def _recommend_lazy_loading(recommendation, issue):
+    recommendation['steps'].append('Implement lazy loading for images')
+    recommendation['code_changes'].append({
+        'file_type': 'html',
+        'description': 'Add loading="lazy" to image tags',
+        'example': '<img src="image.jpg" loading="lazy" alt="Description">'
+    })
+
+def _recommend_responsive_images(recommendation, issue):
+    recommendation['steps'].append('Use responsive image syntax with srcset')
+    recommendation['code_changes'].append({
+        'file_type': 'html',
+        'description': 'Implement srcset for responsive images',
+        'example': '<img srcset="small.jpg 300w, medium.jpg 600w, large.jpg 1200w" sizes="(max-width: 320px) 280px, (max-width: 640px) 580px, 1200px" src="fallback.jpg" alt="Description">'
+    })
+
+def _recommend_image_optimization(recommendation, issue):
+    recommendation['steps'].append('Compress images and use modern formats like WebP')
+    recommendation['steps'].append('Set up an image optimization build step')
+
+def _recommend_text_compression(recommendation, issue):
+    recommendation['steps'].append('Enable GZIP or Brotli compression on your server')
+    recommendation['code_changes'].append({
+        'file_type': 'server',
+        'description': 'Apache: Enable GZIP compression',
+        'example': '''<IfModule mod_deflate.c>
+  AddOutputFilterByType DEFLATE text/html text/plain text/css application/javascript
+</IfModule>'''
+    })
+
+def _recommend_default(recommendation, issue):
+    recommendation['steps'].append(f'Address {issue["title"]}')
+    recommendation['steps'].append('Refer to Lighthouse documentation for specifics')
+
+# Handler for each Lighthouse audit id; add more issue types as needed.
+# Issues without an entry get _recommend_default.
+RECOMMENDATION_HANDLERS = {
+    'render-blocking-resources': _recommend_render_blocking,
+    'unminified-css': _recommend_minification,
+    'unminified-javascript': _recommend_minification,
+    'unused-css-rules': _recommend_unused_css,
+    'unused-javascript': _recommend_unused_javascript,
+    'offscreen-images': _recommend_lazy_loading,
+    'uses-responsive-images': _recommend_responsive_images,
+    'uses-optimized-images': _recommend_image_optimization,
+    'uses-text-compression': _recommend_text_compression,
+}
+
 class OptimizationRecommender:
-    def __init__(self, analyzer_results, url=None):
+    def __init__(self, analyzer_results, url=None, session=None):
         self.analyzer_results = analyzer_results
         self.url = url  # Store the URL for critical CSS extraction
+        self.session = session  # Optional session for the critical CSS fetches
         self.recommendations = []
         self.code_snippets = {}
         self.critical_css = None
@@ -125,67 +386,15 @@ class OptimizationRecommender:
         for issue in issues:
             recommendation = {
                 'issue': issue['title'],
+                'issue_id': issue['id'],
                 'importance': 'high' if issue['score'] < 0.5 else 'medium',
                 'steps': [],
                 'code_changes': []
             }
 
             # Generate specific recommendations based on issue type
-            if issue['id'] == 'render-blocking-resources':
-                recommendation['steps'].append('Add defer attribute to non-critical JavaScript')
-                recommendation['steps'].append('Inline critical CSS and defer non-critical CSS')
-                recommendation['code_changes'].append({
-                    'file_type': 'html',
-                    'description': 'Add defer to script tags',
-                    'example': '<script src="non-critical.js" defer></script>'
-                })
-
-            elif issue['id'] == 'unminified-css' or issue['id'] == 'unminified-javascript':
-                recommendation['steps'].append(f"Minify {issue['id'].split('-')[1].upper()} files")
-                recommendation['steps'].append('Set up build process with minification tools')
-
-            elif issue['id'] == 'unused-css-rules':
-                recommendation['steps'].append('Remove unused CSS')
-                recommendation['steps'].append('Consider using PurgeCSS to automatically remove unused styles')
-
-            elif issue['id'] == 'unused-javascript':
-                recommendation['steps'].append('Implement code splitting')
-                recommendation['steps'].append('Remove dead code')
-
-            elif issue['id'] == 'offscreen-images':
-                recommendation['steps'].append('Implement lazy loading for images')
-                recommendation['code_changes'].append({
-                    'file_type': 'html',
-                    'description': 'Add loading="lazy" to image tags',
-                    'example': '<img src="image.jpg" loading="lazy" alt="Description">'
-                })
-
-            elif issue['id'] == 'uses-responsive-images':
-                recommendation['steps'].append('Use responsive image syntax with srcset')
-                recommendation['code_changes'].append({
-                    'file_type': 'html',
-                    'description': 'Implement srcset for responsive images',
-                    'example': '<img srcset="small.jpg 300w, medium.jpg 600w, large.jpg 1200w" sizes="(max-width: 320px) 280px, (max-width: 640px) 580px, 1200px" src="fallback.jpg" alt="Description">'
-                })
-
-            elif issue['id'] == 'uses-optimized-images':
-                recommendation['steps'].append('Compress images and use modern formats like WebP')
-                recommendation['steps'].append('Set up an image optimization build step')
-
-            elif issue['id'] == 'uses-text-compression':
-                recommendation['steps'].append('Enable GZIP or Brotli compression on your server')
-                recommendation['code_changes'].append({
-                    'file_type': 'server',
-                    'description': 'Apache: Enable GZIP compression',
-                    'example': '''<IfModule mod_deflate.c>
-  AddOutputFilterByType DEFLATE text/html text/plain text/css application/javascript
-</IfModule>'''
-                })
-
-            # Add more issue types as needed
-            else:
-                recommendation['steps'].append(f'Address {issue["title"]}')
-                recommendation['steps'].append('Refer to Lighthouse documentation for specifics')
+            handler = RECOMMENDATION_HANDLERS.get(issue['id'], _recommend_default)
+            handler(recommendation, issue)
 
             self.recommendations.append(recommendation)
 
@@ -198,7 +407,7 @@ class OptimizationRecommender:
 
         try:
             print(f"Extracting critical CSS for {self.url}...")
-            self.critical_css = extract_critical_css(self.url)
+            self.critical_css = extract_critical_css(self.url, session=self.session)
             return self.critical_css
         except Exception as e:
             print(f"Error extracting critical CSS: {e}")
@@ -223,8 +432,14 @@ class OptimizationRecommender:
             'critical_css': self.get_critical_css() if self.url else None
         }
 
-        # Prioritize recommendations
-        prioritized_recs = sorted(self.recommendations, key=lambda x: x['importance'] == 'high', reverse=True)
+        # Prioritize recommendations: high-importance ones first, each group in
+        # its original order. There are only two keys, so partitioning in one
+        # pass replaces the sort.
+        high_priority = []
+        other_priority = []
+        for rec in self.recommendations:
+            (high_priority if rec['importance'] == 'high' else other_priority).append(rec)
+        prioritized_recs = high_priority + other_priority
 
         for i, rec in enumerate(prioritized_recs):
             implementation_guide['prioritized_tasks'].append({
@@ -234,15 +449,16 @@ class OptimizationRecommender:
                 'code_examples': rec['code_changes']
             })
 
-        # Identify automation opportunities
-        if any(r['issue'] == 'uses-optimized-images' for r in self.recommendations):
+        # Identify automation opportunities, collecting the audit ids once
+        issue_ids = {r['issue_id'] for r in self.recommendations}
+        if 'uses-optimized-images' in issue_ids:
             implementation_guide['automation_opportunities'].append({
                 'task': 'Image optimization',
                 'automation_tool': 'Build an automated image optimization pipeline',
                 'implementation_complexity': 'Medium'
             })
 
-        if any(r['issue'] == 'unminified-css' or r['issue'] == 'unminified-javascript' for r in self.recommendations):
+        if 'unminified-css' in issue_ids or 'unminified-javascript' in issue_ids:
             implementation_guide['automation_opportunities'].append({
                 'task': 'Asset minification',
                 'automation_tool': 'Implement webpack/gulp build process',
@@ -255,16 +471,20 @@ class OptimizationRecommender:
         """Estimate potential score improvement"""
         current_score = self.analyzer_results['performance_score']
 
+        max_improvement = 100 - current_score
+
         # Simple heuristic algorithm
         potential_improvement = 0
         for issue in self.analyzer_results['critical_issues']:
-            if issue['score'] < 0.5:
-                potential_improvement += (0.9 - issue['score']) * 5
-            else:
-                potential_improvement += (0.9 - issue['score']) * 2
+            score = issue['score']
+            potential_improvement += (0.9 - score) * (5 if score < 0.5 else 2)
+            # Critical issues all score below 0.9, so the total only grows;
+            # once it reaches the cap the rest can't change the result
+            if potential_improvement >= max_improvement:
+                break
 
         # Cap the maximum improvement
-        potential_improvement = min(potential_improvement, 100 - current_score)
+        potential_improvement = min(potential_improvement, max_improvement)
 
         return {
             'current_score': current_score,
@@ -273,36 +493,96 @@ class OptimizationRecommender:
         }
 
 class AutomatedOptimizer:
-    def __init__(self, url, analyzer, recommender):
+    def __init__(self, url, analyzer, recommender, session=None):
         self.url = url
         self.analyzer = analyzer
         self.recommender = recommender
+        # Shared by the image workers so downloads reuse keep-alive connections
+        self.session = session or create_session(pool_maxsize=MAX_IMAGE_WORKERS)
 
-    def optimize_images(self, image_urls):
-        """Automatically optimize images"""
-        optimized_images = []
+    def _skip_reason(self, img_url):
+        """Check an image's headers, returning why it should be skipped or None"""
+        try:
+            head = self.session.head(img_url, allow_redirects=True, timeout=REQUEST_TIMEOUT)
+        except Exception:
+            # Can't tell without the body; let the download decide
+            return None
+        if not head.ok:
+            return None
 
-        for img_url in image_urls:
-            try:
-                # Download image
-                response = requests.get(img_url)
-                img = Image.open(io.BytesIO(response.content))
+        # Vector images would only lose quality as WebP
+        if head.headers.get('Content-Type', '').startswith('image/svg'):
+            return 'vector image'
 
-                # Optimize image
+        try:
+            if int(head.headers['Content-Length']) < MIN_IMAGE_BYTES:
+                return 'too small'
+        except (KeyError, ValueError):
+            # No usable length (e.g. a chunked response)
+            pass
+        return None
+
+    def _optimize_one_image(self, img_url):
+        """Download and re-encode a single image, returning None on failure"""
+        try:
+            # A HEAD request is enough to rule out tiny and vector images
+            skip_reason = self._skip_reason(img_url)
+            if skip_reason:
+                return {
+                    'original_url': img_url,
+                    'skipped': True,
+                    'reason': skip_reason
+                }
+
+            # Download image
+            response = self.session.get(img_url, timeout=REQUEST_TIMEOUT)
+            original = response.content
+            original_size = len(original)
+            target_size = original_size * (1 - MIN_WEBP_SAVINGS)
+            img = Image.open(io.BytesIO(original))
+
+            # Optimize image
+            output = io.BytesIO()
+            img.save(output, format='WEBP', quality=85, optimize=True)
+            optimized = output.getvalue()
+
+            # Icons, sprites and flat graphics often compress better losslessly;
+            # only pay for the slower lossless encode when lossy didn't pay off
+            if len(optimized) > target_size:
                 output = io.BytesIO()
-                img.save(output, format='WEBP', quality=85, optimize=True)
+                img.save(output, format='WEBP', lossless=True, method=6)
+                if output.tell() < len(optimized):
+                    optimized = output.getvalue()
+
+            # Keep the original if neither encode is meaningfully smaller
+            skipped = len(optimized) > target_size
+            if skipped:
+                optimized = original
+
+            return {
+                'original_url': img_url,
+                'optimized_data': optimized,
+                'original_size': original_size,
+                'optimized_size': len(optimized),
+                'savings_percentage': round((1 - len(optimized) / original_size) * 100, 1),
+                'skipped': skipped
+            }
+        except Exception as e:
+            print(f"Failed to optimize {img_url}: {e}")
+            return None
 
-                optimized_images.append({
-                    'original_url': img_url,
-                    'optimized_data': output.getvalue(),
-                    'original_size': len(response.content),
-                    'optimized_size': output.tell(),
-                    'savings_percentage': round((1 - output.tell() / len(response.content)) * 100, 1)
-                })
-            except Exception as e:
-                print(f"Failed to optimize {img_url}: {e}")
+    def optimize_images(self, image_urls):
+        """Automatically optimize images"""
+        if not image_urls:
+            return []
 
-        return optimized_images
+        # Downloads overlap on the shared session and Pillow releases the GIL
+        # while encoding, so images are processed concurrently; map() keeps
+        # the input order
+        max_workers = min(MAX_IMAGE_WORKERS, len(image_urls))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(self._optimize_one_image, image_urls)
+            return [result for result in results if result is not None]
 
     def generate_critical_css(self, html, css_urls):
         """Extract critical CSS for above-the-fold content"""
@@ -319,102 +599,145 @@ class AutomatedOptimizer:
             'css_minified': "/* CSS would be minified here */"
         }
 
+def _domain_for(url):
+    """Extract domain name from URL for organizing outputs"""
+    domain = urlparse(url).netloc
+    if not domain:
+        domain = "example-com"  # Default if URL parsing fails
+    return domain
+
+def _output_name_for(url):
+    """Name a URL's output directory: its domain, plus a short URL hash for
+    pages below the site root so pages on one host don't overwrite each other"""
+    domain = _domain_for(url)
+    parsed = urlparse(url)
+    if parsed.path in ("", "/") and not parsed.query:
+        return domain
+    return f"{domain}-{hashlib.blake2b(url.encode(), digest_size=4).hexdigest()}"
+
+def _save_report(url, analyzer, extract_critical):
+    """Build recommendations for an analyzed URL and save its reports"""
+    # Create reports directory if it doesn't exist
+    reports_dir = os.path.join("reports", _output_name_for(url))
+    ensure_dir(reports_dir)
+
+    # Run analysis
+    analysis_results = analyzer.analyze_performance()
+
+    # Generate recommendations
+    print("Generating optimization recommendations...")
+    recommender = OptimizationRecommender(analysis_results, url=url if extract_critical else None,
+                                          session=analyzer.session)
+    recommendations = recommender.generate_recommendations()
+    implementation_guide = recommender.generate_implementation_guide()
+
+    # Extract critical CSS if requested
+    if extract_critical:
+        print("Critical CSS extracted and included in the report")
+
+    # Initialize optimizer for automated fixes
+    optimizer = AutomatedOptimizer(url, analyzer, recommender, session=analyzer.session)
+
+    # Generate report
+    report = {
+        'url': url,
+        'analysis': analysis_results,
+        'recommendations': recommendations,
+        'implementation_guide': implementation_guide
+    }
+
+    # Output report to domain-specific directory
+    report_file = os.path.join(reports_dir, 'pagespeed_optimization_report.json')
+    print("Saving report...")
+    write_atomic(report_file, json_dumps(report))
+
+    print(f"Analysis complete. Current score: {analysis_results['performance_score']}")
+    print(f"Potential improvement: {implementation_guide['estimated_score_improvement']['percentage_improvement']}")
+    print(f"Report saved to {report_file}")
+
+    # Save critical CSS to the reports directory if extracted
+    if extract_critical and recommender.critical_css:
+        css_file = os.path.join(reports_dir, 'critical.css')
+        write_atomic(css_file, recommender.critical_css.encode('utf-8'))
+        print(f"Critical CSS saved to {css_file}")
+
 def main():
     parser = argparse.ArgumentParser(description='Analyze website performance using Lighthouse')
-    parser.add_argument('url', nargs='?', default="https://example.com",
-                        help='URL of the website to analyze (default: https://example.com)')
+    parser.add_argument('urls', nargs='*', metavar='url', default=["https://example.com"],
+                        help='URL(s) of the website(s) to analyze (default: https://example.com)')
     parser.add_argument('--use-brave', action='store_true', default=True,
                         help='Use Brave browser instead of Chrome (default: True)')
     parser.add_argument('--use-chrome', dest='use_brave', action='store_false',
                         help='Use Chrome browser instead of Brave')
+    parser.add_argument('--headed', dest='headless', action='store_false', default=True,
+                        help='Show the browser window during audits instead of running headless')
     parser.add_argument('--extract-critical-css', action='store_true',
                         help='Extract critical CSS for the analyzed URL')
     parser.add_argument('--optimize-and-test', action='store_true',
                         help='Create an optimized local version and run comparative tests')
     parser.add_argument('--output-dir', default=None,
                         help='Directory to save the optimized site (default: ./implementation-tests/<domain>)')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='Maximum number of Lighthouse audits to run at once when analyzing several URLs (default: 4)')
     args = parser.parse_args()
 
-    url = args.url
+    urls = list(dict.fromkeys(args.urls))
     use_brave = args.use_brave
     extract_critical = args.extract_critical_css
 
-    # Extract domain name from URL for organizing outputs
-    domain = urlparse(url).netloc
-    if not domain:
-        domain = "example-com"  # Default if URL parsing fails
-
-    # Create reports directory if it doesn't exist
-    reports_dir = os.path.join("reports", domain)
-    os.makedirs(reports_dir, exist_ok=True)
-
-    # Set output directory for optimization tests
-    if args.output_dir:
-        output_dir = args.output_dir
-    else:
-        implementation_tests_dir = os.path.join("implementation-tests", domain)
-        output_dir = implementation_tests_dir
-
     # If optimize-and-test flag is set, run that workflow
     if args.optimize_and_test:
-        print(f"Starting optimization and testing of {url}...")
-        # Create implementation-tests directory if it doesn't exist
-        os.makedirs(os.path.dirname(output_dir), exist_ok=True)
-        optimize_and_test(url, output_dir)
+        for url in urls:
+            output_name = _output_name_for(url)
+
+            # Set output directory for optimization tests; with several URLs
+            # each one gets its own subdirectory
+            if args.output_dir:
+                output_dir = args.output_dir if len(urls) == 1 else os.path.join(args.output_dir, output_name)
+            else:
+                output_dir = os.path.join("implementation-tests", output_name)
+
+            print(f"Starting optimization and testing of {url}...")
+            # Create implementation-tests directory if it doesn't exist
+            ensure_dir(os.path.dirname(output_dir))
+            optimize_and_test(url, output_dir, headless=args.headless)
         return
 
-    print(f"Analyzing {url}...")
+    print(f"Analyzing {', '.join(urls)}...")
     print(f"Using {'Brave' if use_brave else 'Chrome'} browser...")
 
     try:
-        # Initialize analyzer
-        analyzer = WebsitePerformanceAnalyzer(url, use_brave=use_brave)
+        # One connection pool for every HTTP request of the run, so pages,
+        # stylesheets and images on the same hosts reuse keep-alive sockets
+        session = create_session(pool_maxsize=MAX_IMAGE_WORKERS)
 
         # Run analysis
         print("Running Lighthouse analysis...")
-        analysis_results = analyzer.analyze_performance()
-
-        # Generate recommendations
-        print("Generating optimization recommendations...")
-        recommender = OptimizationRecommender(analysis_results, url=url if extract_critical else None)
-        recommendations = recommender.generate_recommendations()
-        implementation_guide = recommender.generate_implementation_guide()
-
-        # Extract critical CSS if requested
-        if extract_critical:
-            print("Critical CSS extracted and included in the report")
-
-        # Initialize optimizer for automated fixes
-        optimizer = AutomatedOptimizer(url, analyzer, recommender)
-
-        # Generate report
-        report = {
-            'url': url,
-            'analysis': analysis_results,
-            'recommendations': recommendations,
-            'implementation_guide': implementation_guide
-        }
-
-        # Output report to domain-specific directory
-        report_file = os.path.join(reports_dir, 'pagespeed_optimization_report.json')
-        print("Saving report...")
-        with open(report_file, 'w') as f:
-            json.dump(report, f, indent=2)
-
-        print(f"Analysis complete. Current score: {analysis_results['performance_score']}")
-        print(f"Potential improvement: {implementation_guide['estimated_score_improvement']['percentage_improvement']}")
-        print(f"Report saved to {report_file}")
-
-        # Save critical CSS to the reports directory if extracted
-        if extract_critical and recommender.critical_css:
-            css_file = os.path.join(reports_dir, 'critical.css')
-            with open(css_file, 'w') as f:
-                f.write(recommender.critical_css)
-            print(f"Critical CSS saved to {css_file}")
+        # Keep the audit browsers alive across URLs instead of cold-starting
+        # one per audit
+        with BrowserPool(size=args.concurrency, use_brave=use_brave, headless=args.headless) as browser_pool:
+            analyzers = WebsitePerformanceAnalyzer.analyze_many(urls, use_brave=use_brave,
+                                                                concurrency=args.concurrency,
+                                                                browser_pool=browser_pool,
+                                                                headless=args.headless,
+                                                                session=session)
+
+        failed = len(urls) - len(analyzers)
+        for url, analyzer in analyzers.items():
+            if len(urls) > 1:
+                print(f"\nResults for {url}:")
+            try:
+                _save_report(url, analyzer, extract_critical)
+            except Exception as e:
+                print(f"Error analyzing {url}: {e}")
+                failed += 1
 
     except Exception as e:
         print(f"Error during analysis: {e}")
         sys.exit(1)
 
+    if failed:
+        sys.exit(1)
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,110 @@
+import json
+import os
+import tempfile
+import requests
+from requests.adapters import HTTPAdapter
+
+# orjson encodes/decodes JSON in native code; fall back to the standard
+# library when it isn't installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# BeautifulSoup tree builder: the C-backed lxml parser when it is installed,
+# otherwise the pure-Python parser from the standard library
+try:
+    import lxml
+    HTML_PARSER = 'lxml'
+except ImportError:
+    HTML_PARSER = 'html.parser'
+
+# Browser-like User-Agent; some servers reject the default python-requests one
+USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+# (connect, read) timeout in seconds for page and asset requests, so a stalled
+# server can't hang a run
+REQUEST_TIMEOUT = (5, 30)
+
+
+def create_session(pool_connections=16, pool_maxsize=32):
+    """Create a requests.Session with keep-alive pooling sized for concurrent use.
+
+    Args:
+        pool_connections: Number of distinct hosts to keep connection pools for
+        pool_maxsize: Maximum number of connections kept alive per host
+
+    Returns:
+        A configured requests.Session
+    """
+    session = requests.Session()
+    session.headers.update({'User-Agent': USER_AGENT})
+
+    # urllib3 discards connections beyond pool_maxsize, so size the pool to
+    # at least the number of worker threads sharing the session
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def json_loads(data):
+    """Parse a JSON document from str or bytes, using orjson when available."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_dumps(obj):
+    """Serialize obj to indented JSON bytes, using orjson when available."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+        except TypeError:
+            # orjson is stricter than json (e.g. about non-str keys); let the
+            # standard library handle whatever it rejects
+            pass
+    return json.dumps(obj, indent=2).encode('utf-8')
+
+
+# Directories already created by ensure_dir in this process
+_created_dirs = set()
+
+
+def ensure_dir(path):
+    """Create a directory (and its parents) unless this process already did.
+
+    An empty path means the current directory and is left alone.
+    """
+    if not path or path in _created_dirs:
+        return
+    os.makedirs(path, exist_ok=True)
+    _created_dirs.add(path)
+
+
+# The process umask, read once at import (reading it means briefly changing
+# it, which isn't safe once threads are running)
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def write_atomic(path, data):
+    """Write bytes to path via a temporary file, so readers never see a partial file.
+
+    Each call gets its own temporary file, so concurrent writers to the same
+    path don't clobber each other; the last one to finish wins.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.',
+                                    prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        # mkstemp creates the file owner-only; give it the usual permissions
+        os.chmod(tmp_path, 0o666 & ~_UMASK)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise